@@ -1,35 +1,193 @@
 
-from tqdm import tqdm
-import numpy as np
-from skimage import img_as_ubyte
-
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-import xml.etree.ElementTree as ET
+import io
 import os, sys
 import csv
-
-try:
-    from brachistools.gui import gui
-    GUI_ENABLED = True
-except ImportError as err:
-    GUI_ERROR = err
-    GUI_ENABLED = False
-    GUI_IMPORT = True
-except Exception as err:
-    GUI_ERROR = err
-    GUI_ENABLED = False
-    GUI_IMPORT = False
-    raise
+import queue
+import threading
 
 import logging
 
-from brachistools.segmentation import segmentation_pipeline, default_segmentation_params
-from brachistools.classification import classification_pipeline
-from brachistools.io import load_folder, imread, imsave, labels_to_xml, xml_to_labels
-from brachistools.version import version_str
+# Heavy dependencies (numpy, skimage, keras, Qt) are imported lazily
+# inside the subcommand branches and worker functions, so short-lived
+# invocations like `brachistools version` do not pay their startup cost
+
+CLASSIFY_BATCH_SIZE = 32
+
+# Queue feeding the background writer thread of the current process;
+# created lazily so that pool workers each get their own
+_write_q = None
+
+def _writer_loop(q):
+    import numpy as np
+    from brachistools.io import imsave
+
+    while True:
+        jobs = q.get()
+        try:
+            # One image's writes are a unit processed in order; the
+            # first failure skips the rest, so a later artifact (the
+            # --skip_existing marker among them) never lands without
+            # its predecessors
+            for kind, path, payload in jobs:
+                if kind == 'image':
+                    imsave(path, payload)
+                elif kind == 'xml':
+                    # Serialize in memory first: one write() instead of
+                    # one per element
+                    buf = io.BytesIO()
+                    payload.write(buf, encoding='utf-8', xml_declaration=True)
+                    Path(path).write_bytes(buf.getvalue())
+                elif kind == 'npy':
+                    with open(path, 'wb', buffering=1<<20) as f:
+                        np.save(f, payload, allow_pickle=False)
+                elif kind == 'npz':
+                    with open(path, 'wb', buffering=1<<20) as f:
+                        np.savez(f, **payload)
+        except Exception as e:
+            logging.getLogger(__name__).critical(
+                "Failed to write '%s' due to exception: %s", path, e)
+        finally:
+            q.task_done()
+
+def _enqueue_write(jobs):
+    """Hand one image's (kind, path, payload) writes to the writer thread
+
+    Encoding and writing then overlap with the next image's compute.
+    The queue is flushed through multiprocessing's exit machinery,
+    which — unlike atexit — also runs in ProcessPoolExecutor workers
+    (they leave through os._exit after _bootstrap), so pending writes
+    land before the (worker) process terminates.
+    """
+    from multiprocessing.util import Finalize
+
+    global _write_q
+    if _write_q is None:
+        _write_q = queue.Queue(maxsize=4)
+        threading.Thread(target=_writer_loop, args=(_write_q,), daemon=True).start()
+        Finalize(None, _write_q.join, exitpriority=10)
+    _write_q.put(jobs)
+
+def _show_one(seg_xml, in_dir, out_dir, save_npy, use_tqdm, skip_existing=False):
+    """Transform one segmentation XML; returns (name, error or None)"""
+    import numpy as np
+    from brachistools.io import imsave, xml_to_labels
+
+    try:
+        root_fn = Path(seg_xml).stem
+        if root_fn.endswith('_seg'):
+            root_fn = root_fn[:-len('_seg')]
+
+        if skip_existing and (out_dir / (root_fn + '_xml2seg.PNG')).exists():
+            return seg_xml, None
+
+        labels, pic = xml_to_labels(in_dir / seg_xml, use_tqdm=use_tqdm)
+        imsave(out_dir / (root_fn + '_xml2seg.PNG'), pic)
+        if save_npy:
+            np.save(out_dir / (root_fn + '_xml2seg.npy'), labels)
+    except Exception as e:
+        # repr, not the exception itself: exception objects (e.g.
+        # lxml's XMLSyntaxError) may not survive pickling back to the
+        # parent
+        return seg_xml, repr(e)
+    return seg_xml, None
+
+def _compact_labels(labels):
+    """Downcast a label map to the smallest unsigned dtype that fits
+
+    skimage labeling returns platform int (usually int64); for typical
+    nucleus counts uint8/uint16 suffice and cut the saved bytes 4-8x.
+    """
+    import numpy as np
+
+    n = int(labels.max()) if labels.size else 0
+    if n < 2**8:
+        dt = np.uint8
+    elif n < 2**16:
+        dt = np.uint16
+    else:
+        dt = np.uint32
+    return labels.astype(dt, copy=False)
+
+def _segment_one(fn, in_dir, out_dir, save_format, save_npy, segment_params,
+                 skip_existing=False):
+    """Segment one image and save its outputs; returns (name, error or None)"""
+    from brachistools.io import imread, labels_to_xml
+    from brachistools.segmentation import segmentation_pipeline
+
+    try:
+        root = Path(fn).stem
+        # Check before imread so skipped files don't pay decode cost.
+        # Test the last artifact in writer-queue order: its presence
+        # implies the earlier writes landed too
+        done_marker = f"{root}_mask.npz" if save_npy else f"{root}_seg.xml"
+        if skip_existing and (out_dir / done_marker).exists():
+            return fn, None
+
+        image = imread(in_dir / fn)
+        nucleus, labeled_nucleus = segmentation_pipeline(image, segment_params)
+        # `imsave` specializes boolean masks (1-bit PNG fast path)
+        jobs = [
+            ('image', out_dir / f"{root}_mask.{save_format}", nucleus),
+            ('xml', out_dir / f"{root}_seg.xml", labels_to_xml(labeled_nucleus)),
+        ]
+        if save_npy:
+            # One archive per image: a single fd/header/write instead
+            # of two .npy files
+            jobs.append(('npz', out_dir / (root + '_mask.npz'),
+                         {'mask': nucleus,
+                          'labels': _compact_labels(labeled_nucleus)}))
+        _enqueue_write(jobs)
+    except Exception as e:
+        # See _show_one: exception objects may not pickle
+        return fn, repr(e)
+    return fn, None
+
+def _prefetch(in_dir, names, n=2):
+    """Decode images on a background thread, keeping at most `n` ahead
+
+    Yields (name, image) pairs in order. `imread` releases the GIL in
+    its native decode path, so the next image loads while the caller is
+    still busy with the current one. If a file fails to load, the
+    exception object is yielded in place of its image so the caller
+    can report it and move on.
+    """
+    from brachistools.io import imread
+
+    q = queue.Queue(maxsize=n)
+    def produce():
+        # The sentinel must go out even if a read fails, or the
+        # consumer would block on q.get() forever
+        try:
+            for fn in names:
+                try:
+                    item = (fn, imread(in_dir / fn))
+                except Exception as e:
+                    item = (fn, e)
+                q.put(item)
+        finally:
+            q.put(None)
+    threading.Thread(target=produce, daemon=True).start()
+    while (item := q.get()) is not None:
+        yield item
+
+def _progress(iterable, total):
+    """Outer progress bar configured for minimal per-item overhead
+
+    Refreshes are throttled for large inputs and the bar is disabled
+    entirely on non-TTY output (CI, log redirection).
+    """
+    from tqdm import tqdm
+    return tqdm(iterable, total=total, smoothing=0.02,
+                mininterval=0.5, miniters=max(1, total // 200),
+                disable=None)
 
 def get_arg_parser():
+    from brachistools.segmentation import default_segmentation_params
+
     parser = argparse.ArgumentParser(description="Brachistools Command Line Parameters")
     parser.add_argument('--verbose', action='store_true', help="print additional messages")
 
@@ -48,9 +206,14 @@ def get_arg_parser():
     output_args.add_argument('--save_dir', default=None, type=str,
                              help="folder to which segmentation results will be saved (defaults to input image directory)")
     output_args.add_argument('--save_npy', action='store_true',
-                             help="save instance segmentation results as '.npy' labeled mask arrays. "
+                             help="save instance segmentation results as labeled mask arrays "
+                             "(a '_mask.npz' archive with 'mask' and 'labels' entries for segment, "
+                             "a '.npy' array for show). "
                              "For instance segmentation, the XML format will always be saved regardless of "
                              "this option")
+    output_args.add_argument('--skip_existing', action='store_true',
+                             help="skip inputs whose outputs already exist, so an interrupted "
+                             "run can resume where it stopped")
 
     subparsers = parser.add_subparsers(dest='command')
 
@@ -115,6 +278,7 @@ def main():
     args = get_arg_parser().parse_args()
 
     if args.command == 'version':
+        from brachistools.version import version_str
         print(version_str)
         return
 
@@ -129,6 +293,19 @@ def main():
     # device, gpu = classification.assign_device(use_tensorflow=True, gpu=args.use_gpu, device=...)
 
     if args.command == 'gui':
+        try:
+            from brachistools.gui import gui
+            GUI_ENABLED = True
+        except ImportError as err:
+            GUI_ERROR = err
+            GUI_ENABLED = False
+            GUI_IMPORT = True
+        except Exception as err:
+            GUI_ERROR = err
+            GUI_ENABLED = False
+            GUI_IMPORT = False
+            raise
+
         if not GUI_ENABLED:
             print('GUI ERROR:', GUI_ERROR)
             if GUI_IMPORT:
@@ -137,6 +314,7 @@ def main():
             sys.exit(-1)
         else:
             gui.run()
+            return
 
     if args.command == 'config':
         from configparser import ConfigParser
@@ -153,8 +331,11 @@ def main():
 
         with open(config_path, 'w') as config_f:
             config.write(config_f)
+        return
 
     # Prepare images
+    from brachistools.io import load_folder
+
     if args.dir and args.image_path:
         logger.critical("Cannot specify both --dir and --image_path")
         sys.exit(-1)
@@ -168,11 +349,9 @@ def main():
         image_names = load_folder(args.dir,
             file_ext=file_ext, absolute_path=False,
             ignored_suffixes=args.ignored_suffixes)
-        if len(image_names) > 1:
-            image_names = tqdm(image_names)
     elif args.image_path:
         args.dir = str(Path(args.image_path).parent)
-        image_names = [args.image_path]
+        image_names = [Path(args.image_path).name]
     else:
         logger.critical("Input is not specified")
         sys.exit(-1)
@@ -180,31 +359,36 @@ def main():
     if not args.save_dir:
         args.save_dir = args.dir
 
-    def savepath(fn):
-        return os.path.join(args.save_dir, fn)
+    in_dir = Path(args.dir)
+    out_dir = Path(args.save_dir)
 
     if args.command == 'show':
         # from brachistools.io import HAVE_MATPLOTLIB
         # if not HAVE_MATPLOTLIB:
         #     logger.info("Showing segmentation XMLs requires matplotlib. Saving picture only")
 
-        for seg_xml in image_names:
-            try:
-                root_fn, old_ext = os.path.splitext(seg_xml)
-                if root_fn.endswith('_seg'):
-                    root_fn = root_fn[:-4]
-
-                tree = ET.parse(os.path.join(args.dir, seg_xml))
-                labels, pic = xml_to_labels(tree, use_tqdm=len(image_names)==1)
-                imsave(savepath(root_fn + '_xml2seg.PNG'), pic)
-                if args.save_npy:
-                    np.save(savepath(root_fn + '_xml2seg.npy'), labels)
-            except Exception as e:
+        # Inner per-region tqdm stays off under the pool: workers would
+        # contend for stdout and the outer bar is the one that matters
+        show_one = partial(_show_one,
+            in_dir=in_dir, out_dir=out_dir,
+            save_npy=args.save_npy, use_tqdm=False,
+            skip_existing=args.skip_existing)
+        if len(image_names) == 1:
+            # Single file: skip the pool spawn and keep the inner bar
+            results = [show_one(image_names[0], use_tqdm=True)]
+        else:
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+                results = list(_progress(ex.map(show_one, image_names, chunksize=4),
+                                         total=len(image_names)))
+        for seg_xml, err in results:
+            if err is not None:
                 logger.critical(
                     "Failed to transform segmentation XML '%s' "
-                    "due to exception: %s", seg_xml, e)
+                    "due to exception: %s", seg_xml, err)
 
     if args.command == 'segment':
+        from brachistools.segmentation import default_segmentation_params
+
         segment_params = default_segmentation_params.copy()
         segment_params['vahadane:sparsity_regularizer'] = args.vahadane_sparsity_regularizer
         segment_params['equalize_adapthist:clip_limit'] = args.equalize_adapthist_clip_limit
@@ -214,35 +398,84 @@ def main():
         segment_params['peak_local_max:threshold_rel'] = args.local_max_threshold_rel
         segment_params['merge_small_labels:min_size'] = args.small_labels_min_size
 
-        for fn in image_names:
-            try:
-                image = imread(os.path.join(args.dir, fn))
-                nucleus, labeled_nucleus = segmentation_pipeline(image, segment_params)
-
-                root, old_ext = os.path.splitext(fn)
-                imsave(savepath(f"{root}_mask.{args.save_format}"), img_as_ubyte(nucleus))
-                labels_to_xml(labeled_nucleus).write(savepath(f"{root}_seg.xml"))
-
-                if args.save_npy:
-                    np.save(savepath(root + '_mask.npy'), nucleus)
-                    np.save(savepath(root + '_mask_labels.npy'), labeled_nucleus)
-            except Exception as e:
+        segment_one = partial(_segment_one,
+            in_dir=in_dir, out_dir=out_dir,
+            save_format=args.save_format, save_npy=args.save_npy,
+            segment_params=segment_params,
+            skip_existing=args.skip_existing)
+        if len(image_names) == 1:
+            results = [segment_one(image_names[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+                results = list(_progress(ex.map(segment_one, image_names, chunksize=4),
+                                         total=len(image_names)))
+        for fn, err in results:
+            if err is not None:
                 logger.critical(
                     "Failed to segmentation picture '%s' "
-                    "due to exception: %s", fn, e)
+                    "due to exception: %s", fn, err)
 
     if args.command == 'classify':
-        with open('./result.csv', 'w', newline='') as csvfile:
-            fieldnames = ['Image Name', 'Predict', 'Confidence']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-            writer.writeheader()
-
-            for fn in image_names:
-                image = imread(fn)
-                predict_class, confidence_score = classification_pipeline(image)
-                writer.writerow(
-                    {'Image Name': fn, 'Predict': predict_class, 'Confidence': confidence_score})
+        from brachistools.classification import (
+            classification_pipeline_batch, load_classification_model)
+
+        # Load the model once up front; the batch loop is then pure
+        # iteration
+        model = load_classification_model()
+
+        csv_path = './result.csv'
+        header = ('Image Name', 'Predict', 'Confidence')
+
+        # Resume from a previous run's CSV when asked to
+        done = set()
+        resume = args.skip_existing and os.path.exists(csv_path)
+        if resume:
+            with open(csv_path, newline='') as csvfile:
+                content = csvfile.read()
+            # A crash can cut the final row mid-write; drop it so its
+            # image is redone and the appended rows stay well-formed
+            truncated = bool(content) and not content.endswith(('\n', '\r'))
+            rows = list(csv.reader(io.StringIO(content)))
+            if truncated and rows:
+                rows.pop()
+            if not rows or tuple(rows[0]) != header:
+                resume = False
+            else:
+                done = {row[0] for row in rows[1:] if row}
+                if truncated:
+                    with open(csv_path, 'w', newline='') as csvfile:
+                        csv.writer(csvfile).writerows(rows)
+        if done:
+            image_names = [fn for fn in image_names if fn not in done]
+
+        with open(csv_path, 'a' if resume else 'w', newline='',
+                  buffering=1<<20) as csvfile:
+            writer = csv.writer(csvfile)
+            if not resume:
+                writer.writerow(header)
+
+            names = []
+            images = []
+            def flush_batch():
+                predict_classes, confidence_scores = classification_pipeline_batch(
+                    images, model=model)
+                writer.writerows(zip(names, predict_classes, confidence_scores))
+                names.clear()
+                images.clear()
+
+            for fn, image in _progress(_prefetch(in_dir, image_names, n=CLASSIFY_BATCH_SIZE),
+                                       total=len(image_names)):
+                if isinstance(image, Exception):
+                    logger.critical(
+                        "Failed to read picture '%s' "
+                        "due to exception: %s", fn, image)
+                    continue
+                names.append(fn)
+                images.append(image)
+                if len(images) == CLASSIFY_BATCH_SIZE:
+                    flush_batch()
+            if images:
+                flush_batch()
 
 if __name__ == "__main__":
     main()
@@ -8,9 +8,17 @@ import sys, os
 
 global logger
 
-def classification_pipeline(input_image):
-    from configparser import ConfigParser
+CLASS_NAMES = ['benign', 'malignant']
 
+_model_cache = {}
+
+def load_classification_model():
+    """Load the classifier configured in config.ini
+
+    Loaded models are cached by parameter path, so repeated pipeline
+    calls in one process reuse the same weights instead of re-reading
+    the .h5 file per image.
+    """
     try:
         config_path = 'config.ini'
         config = ConfigParser()
@@ -20,18 +28,46 @@ def classification_pipeline(input_image):
         raise RuntimeError("Failed to open config file")
 
     param_dir = config.get('ModelParams', 'param_dir').strip('\"\'')
-    model = load_model(os.path.join(param_dir, 'model.h5'))
-    classes = ['benign', 'malignant']
+    model_path = os.path.join(param_dir, 'model.h5')
+    model = _model_cache.get(model_path)
+    if model is None:
+        model = load_model(model_path)
+        _model_cache[model_path] = model
+    return model
 
+def _resize_input(input_image):
     # In training, `cv2.resize` is used
     # `skimage` resize has slightly different output but does not
     # affect the output significantly
     # Using skimage only would allow us to drop the requirement on
     # opencv-python
-    im = skimage.transform.resize(input_image, (224, 224),
+    return skimage.transform.resize(input_image, (224, 224),
         preserve_range=True, anti_aliasing=False).astype(np.uint8)
+
+def classification_pipeline(input_image, model=None):
+    if model is None:
+        model = load_classification_model()
+
+    im = _resize_input(input_image)
     predict_results = model.predict(np.expand_dims(im, axis=0), verbose=0)
 
-    predict_class = classes[np.argmax(predict_results)]
+    predict_class = CLASS_NAMES[np.argmax(predict_results)]
     confidence_score = format(np.max(predict_results), '.4f')
     return predict_class, confidence_score
+
+def classification_pipeline_batch(input_images, model=None):
+    """Classify a batch of images with a single model forward pass
+
+    Returns `(predict_classes, confidence_scores)` lists aligned with
+    the input order. One batched forward amortizes the per-call Python
+    and framework overhead of predicting images one at a time.
+    """
+    if model is None:
+        model = load_classification_model()
+
+    batch = np.stack([_resize_input(im) for im in input_images])
+    predict_results = model.predict(batch, verbose=0)
+
+    predict_classes = [CLASS_NAMES[i] for i in np.argmax(predict_results, axis=1)]
+    confidence_scores = [format(score, '.4f') for score in np.max(predict_results, axis=1)]
+    return predict_classes, confidence_scores
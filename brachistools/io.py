@@ -4,12 +4,16 @@ import os, sys
 import logging
 import pathlib
 from pathlib import Path
-import xml.etree.ElementTree as ET
+try:
+    from lxml import etree as ET
+    HAVE_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
 from natsort import natsorted
-from skimage.io import imread, imsave
+from skimage.io import imread as _skimage_imread, imsave as _skimage_imsave
 import numpy as np
 
-from .version import version_str
 from .transforms import get_hue_colors
 
 try:
@@ -24,9 +28,52 @@ try:
 except:
     HAVE_MATPLOTLIB = False
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbojpeg = TurboJPEG()
+    HAVE_TURBOJPEG = True
+except:
+    HAVE_TURBOJPEG = False
+
+try:
+    from PIL import Image
+    HAVE_PIL = True
+except ImportError:
+    HAVE_PIL = False
+
 io_logger = logging.getLogger(__name__)
 
+def imread(path):
+    """Read an image, decoding JPEGs with libjpeg-turbo when available"""
+    if HAVE_TURBOJPEG and os.path.splitext(str(path))[1].lower() in ('.jpg', '.jpeg'):
+        with open(path, 'rb') as f:
+            return _turbojpeg.decode(f.read(), pixel_format=TJPF_RGB)
+    return _skimage_imread(path)
+
+def imsave(path, arr):
+    """Save an image, specializing boolean masks
+
+    Boolean PNG output is packed to a native 1-bit image when PIL is
+    available (8x fewer bytes through the encoder); other boolean
+    output takes a single dtype-targeted multiply instead of
+    img_as_ubyte's generic rescale.
+    """
+    if getattr(arr, 'dtype', None) == bool:
+        if HAVE_PIL and os.path.splitext(str(path))[1].lower() == '.png':
+            height, width = arr.shape
+            with open(path, 'wb', buffering=1<<20) as f:
+                Image.frombytes(
+                    '1', (width, height), np.packbits(arr, axis=1).tobytes()
+                ).save(f, format='PNG', optimize=False)
+            return
+        arr = np.multiply(arr, 255, dtype=np.uint8)
+    _skimage_imsave(path, arr)
+
 def logger_setup():
+    # Rendering the version string imports tensorflow; defer it to
+    # here so merely importing this module stays cheap
+    from .version import version_str
+
     cp_dir = Path.home().joinpath('.brachistools')
     cp_dir.mkdir(exist_ok=True)
     log_file = cp_dir.joinpath('run.log')
@@ -114,39 +161,68 @@ def labels_to_xml(labels, bg_label=0) -> ET.ElementTree:
     tree = ET.ElementTree(root)
     return tree
 
-def xml_to_labels(tree: ET.ElementTree, use_tqdm=False):
+def _extract_region(region):
+    """Pull vertex rows/cols and the bounding box out of a Region element"""
+    if HAVE_LXML:
+        # Batch-extract the coordinate strings in libxml2 instead of
+        # touching every Vertex element from Python
+        rows = np.array(region.xpath('Vertices/Vertex/@Y'), dtype=np.float64)
+        cols = np.array(region.xpath('Vertices/Vertex/@X'), dtype=np.float64)
+    else:
+        vertices = region.findall('Vertices/Vertex')
+        rows = np.array([point.attrib['Y'] for point in vertices], dtype=np.float64)
+        cols = np.array([point.attrib['X'] for point in vertices], dtype=np.float64)
+
+    bbox = region.find('BoundingBox')
+    bbox = (float(bbox.attrib['Y']), float(bbox.attrib['X']),
+            float(bbox.attrib['Height']), float(bbox.attrib['Width']))
+    return rows, cols, bbox
+
+def xml_to_labels(source, use_tqdm=False):
+    """Rasterize a segmentation XML into a label map and RGB picture
+
+    `source` may be a file path, parsed incrementally with `iterparse`
+    so peak memory is bounded by the extracted contours rather than the
+    full DOM, or an already-parsed ElementTree.
+    """
     from tqdm import tqdm
     from skimage.draw import polygon, polygon2mask
 
-    root = tree.getroot()
-    width, height = int(root.attrib['Width']), int(root.attrib['Height'])
+    if isinstance(source, (str, os.PathLike)):
+        width = height = None
+        regions = []
+        if HAVE_LXML:
+            context = ET.iterparse(str(source), events=('start', 'end'), huge_tree=True)
+        else:
+            context = ET.iterparse(str(source), events=('start', 'end'))
+        for event, elem in context:
+            if event == 'start':
+                if width is None and elem.tag == 'Annotation':
+                    width, height = int(elem.attrib['Width']), int(elem.attrib['Height'])
+            elif elem.tag == 'Region':
+                regions.append(_extract_region(elem))
+                elem.clear()
+    else:
+        root = source.getroot()
+        width, height = int(root.attrib['Width']), int(root.attrib['Height'])
+        regions = [_extract_region(region) for region in root.findall('Regions/Region')]
 
-    regions = root.findall('Regions/Region')
     im = np.zeros(shape=(height, width, 3)) # Prepare RGB
-    labels = np.zeros(shape=(height, width), dtype=int)
+    labels = np.zeros(shape=(height, width), dtype=np.int32)
     colors = get_hue_colors(len(regions))
     np.random.shuffle(colors)
 
     loopvar = enumerate(zip(regions, colors))
     if use_tqdm:
         loopvar = tqdm(loopvar, desc="Drawing regions", total=len(regions))
-    for i, (region, color) in loopvar:
-        rows = []
-        cols = []
-        for point in region.findall('Vertices/Vertex'):
-            rows.append(float(point.attrib['Y']))
-            cols.append(float(point.attrib['X']))
-
+    for i, ((rows, cols, bbox), color) in loopvar:
         ridx, cidx = polygon(rows, cols, shape=(height, width))
         # Draw polygon with the color
         im[ridx, cidx] = color
         labels[ridx, cidx] = i + 1
 
         # Draw bbox
-        bbox = region.find('BoundingBox')
-        min_y, min_x = float(bbox.attrib['Y']), float(bbox.attrib['X'])
-        y_ext, x_ext = float(bbox.attrib['Height']), float(bbox.attrib['Width'])
-        min_y, min_x, y_ext, x_ext = int(min_y), int(min_x), int(y_ext), int(x_ext)
+        min_y, min_x, y_ext, x_ext = (int(v) for v in bbox)
         max_y, max_x = min_y + y_ext + 1, min_x + x_ext + 1
         im[min_y:max_y, min_x] = color
         im[min_y:max_y, max_x-1] = color
@@ -1,16 +1,14 @@
 
-from skimage.exposure import equalize_adapthist
-from skimage.filters import threshold_otsu
-from skimage.morphology import remove_small_objects, remove_small_holes
-from scipy.ndimage import distance_transform_edt
-from skimage.feature import peak_local_max
-from skimage.segmentation import watershed
-import numpy as np
-
-from .transforms import VahadaneStainDeconvolution, inverted_gray_scale
+# Keep module import light: the numpy/skimage/scipy machinery is
+# imported inside the functions that use it, so that pulling in
+# `default_segmentation_params` (e.g. for CLI argument defaults) stays
+# cheap
+
 from .utils import ParamDict
 
 def vahadane(sparsity_regularizer):
+    from .transforms import VahadaneStainDeconvolution
+
     vahadane_transform = VahadaneStainDeconvolution(sparsity_regularizer=sparsity_regularizer)
     def deconvolute_hematoxylin(image):
         return vahadane_transform.F(image=image, method='hematoxylin')
@@ -23,7 +21,9 @@ default_segmentation_params = ParamDict({
     'remove_small_holes:area_threshold': 100,
     'peak_local_max': {
         'min_distance': 12,
-        'footprint': np.ones((15, 15)),
+        # Shape tuple, materialized to np.ones(...) by the pipeline;
+        # keeps this module importable without numpy
+        'footprint': (15, 15),
         'threshold_rel': 0.2
     },
     'merge_small_labels': {
@@ -34,6 +34,16 @@ default_segmentation_params = ParamDict({
 
 def segmentation_pipeline(input_image, params):
     from skimage import img_as_ubyte
+    from skimage.exposure import equalize_adapthist
+    from skimage.filters import threshold_otsu
+    from skimage.morphology import remove_small_objects, remove_small_holes
+    from scipy.ndimage import distance_transform_edt
+    from skimage.feature import peak_local_max
+    from skimage.segmentation import watershed
+
+    import numpy as np
+
+    from .transforms import inverted_gray_scale
 
     vahadane_transform = vahadane(**params['vahadane'])
 
@@ -50,17 +60,23 @@ def segmentation_pipeline(input_image, params):
     nuclei = remove_small_holes(nuclei, **params['remove_small_holes'])
 
     distances = distance_transform_edt(nuclei)
-    local_maxima_idx = peak_local_max(distances, **params['peak_local_max'])
+    peak_params = dict(params['peak_local_max'])
+    if isinstance(peak_params.get('footprint'), tuple):
+        peak_params['footprint'] = np.ones(peak_params['footprint'])
+    local_maxima_idx = peak_local_max(distances, **peak_params)
     markers = peaks_to_markers(local_maxima_idx, shape=nuclei.shape)
     labeled_nuclei = watershed(-distances, markers, mask=nuclei)
     labeled_nuclei = merge_small_labels(labeled_nuclei, **params['merge_small_labels'])
-    return nuclei, labeled_nuclei
+    return nuclei, labeled_nuclei.astype(np.int32, copy=False)
 
 def peaks_to_markers(peaks, shape):
+    import numpy as np
     from skimage.measure import label
     mask = np.zeros(shape, dtype=bool)
     mask[tuple(peaks.T)] = True
-    markers = label(mask)
+    # int32 markers halve the label map's footprint vs the default
+    # platform int and propagate through watershed and the merge step
+    markers = label(mask).astype(np.int32, copy=False)
     return markers
 
 def merge_small_labels(labelled_mask, min_size, verbose = True):
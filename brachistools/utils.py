@@ -24,9 +24,12 @@ class ParamDict:
         return par
 
     def copy(self):
-        # Save parsing
+        # Save parsing; nested method dicts are copied too so that
+        # setting a parameter on the copy never mutates the source
         x = ParamDict({})
-        x._params = self._params.copy()
+        x._params = {
+            k: (v.copy() if isinstance(v, dict) else v)
+            for k, v in self._params.items()}
         return x
 
     def __getitem__(self, key):
@@ -37,6 +40,9 @@ class ParamDict:
             method, param_name = key.split(':')
             meth_dict = self._params.setdefault(method, dict())
             meth_dict[param_name] = value
+            # Keep the flat 'method:param' key in sync with the
+            # nested dict
+            self._params[key] = value
         except:
             if not isinstance(value, dict):
                 raise ValueError
@@ -7,15 +7,24 @@ Adapted by: YUAN Ruihong
 from importlib.metadata import PackageNotFoundError, version
 import sys
 from platform import python_version
-import tensorflow
 
 try:
     brachistools_version = version("brachistools")
 except PackageNotFoundError:
     brachistools_version = 'unknown'
 
-version_str = f"""
+def _build_version_str():
+    # Importing tensorflow takes seconds; only pay for it when the
+    # version string is actually rendered
+    import tensorflow
+
+    return f"""
 brachistools version:\t{brachistools_version}
 platform:           \t{sys.platform}
 python version:     \t{python_version()}
 tensorflow version:      \t{tensorflow.__version__}"""
+
+def __getattr__(name):
+    if name == 'version_str':
+        return _build_version_str()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")